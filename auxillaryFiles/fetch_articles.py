@@ -58,6 +58,9 @@ for key in keys:
     if not url:
         print(f"{key}: no url")
         continue
+    if entry.get("file"):
+        print(f"{key}: already has file field, skipping")
+        continue
     try:
         html = requests.get(url, timeout=20).text
         text = trafilatura.extract(html)
@@ -69,7 +72,7 @@ for key in keys:
         continue
     path = os.path.join(out_dir, filename_for(entry, key))
     with open(path, "w") as f:
-        f.write(f"{url}\n\n{text}\n")
+        f.writelines((url, "\n\n", text, "\n"))
     bib_text, status = add_file_field(bib_text, key, path)
     uri = "file://" + urllib.parse.quote(path)
     link = f"\033]8;;{uri}\033\\{path}\033]8;;\033\\"
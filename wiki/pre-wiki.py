@@ -8,6 +8,10 @@ import re
 import sys
 from pathlib import Path
 
+# Matches: \cite, \textcite, \parencite, \autocite, etc.
+# Captures the command type and citation keys
+_CITE_RE = re.compile(r'\\(text|paren|auto)?cite\{([^}]+)\}')
+
 
 def main():
     if len(sys.argv) < 3:
@@ -22,21 +26,13 @@ def main():
     # Replace citation commands with placeholders
     # Handles: \cite{key}, \cite{key1,key2}, \textcite{key}, etc.
 
-    # Pattern matches: \cite, \textcite, \parencite, \autocite, etc.
-    # Captures the command type and citation keys
     def replace_cite(match):
-        cmd_type = match.group(1) if match.group(1) else ''  # text, paren, auto, or empty
-        keys = match.group(2)  # the keys
-        if cmd_type == 'text':
-            return f'<<<TEXTCITE:{keys}>>>'
-        else:
-            return f'<<<CITE:{keys}>>>'
-
-    content = re.sub(
-        r'\\(text|paren|auto)?cite\{([^}]+)\}',
-        replace_cite,
-        content
-    )
+        # group(1) is text, paren, auto, or None; group(2) is the keys
+        if match.group(1) == 'text':
+            return f'<<<TEXTCITE:{match.group(2)}>>>'
+        return f'<<<CITE:{match.group(2)}>>>'
+
+    content = _CITE_RE.sub(replace_cite, content)
 
     output_path.write_text(content, encoding='utf-8')
     print(f"Pre-processed {input_path.name} -> {output_path.name}")
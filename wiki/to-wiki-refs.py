@@ -8,39 +8,204 @@ import re
 import sys
 from pathlib import Path
 
+# Patterns used per entry/author/placeholder, compiled once
+_WS_RE = re.compile(r'\s+')
+_NAME_SPLIT_RE = re.compile(r'[{}]|\s+and\s+')
+_LATEX_CMD_END_RE = re.compile(r'\\(?:[A-Za-z]+|[^A-Za-z\s])\s*$')
+_TEXTIT_RE = re.compile(r'\\textit\{([^}]+)\}')
+_EMPH_RE = re.compile(r'\\emph\{([^}]+)\}')
+_PLACEHOLDER_RE = re.compile(r'<<<(CITE|TEXTCITE):([^<>]+)>>>')
+_ESCAPED_CLOSER_RE = re.compile(r'(<<<(?:CITE|TEXTCITE):[^<>&]+)&gt;&gt;&gt;')
+_REFERENCES_TAG_RE = re.compile(r'<references\s*/>')
+
+# BibTeX scanner: jump between delimiters instead of stepping per character
+_BRACE_RE = re.compile(r'[{}]')
+_QUOTED_VALUE_RE = re.compile(r'[{}"]')
+_BARE_VALUE_END_RE = re.compile(r'[,}]')
+_KEY_END_RE = re.compile(r'[,}]')
+_FIELD_SEP_RE = re.compile(r'[\s,]*')
+_OPT_WS_RE = re.compile(r'\s*')
+
+
+def _skip_braced(text, i):
+    """
+    Skip a {...} group starting at text[i] == '{', honouring nesting.
+    Returns the index just past the matching close brace.
+    """
+    depth = 0
+    for match in _BRACE_RE.finditer(text, i):
+        if match.group() == '{':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    return len(text)
+
+
+def _read_value(text, i):
+    """
+    Read a field value starting at text[i].
+    Handles {braced}, "quoted" and bare (number/macro) values.
+    Returns (value, index just past the value).
+    """
+    if text[i] == '{':
+        end = _skip_braced(text, i)
+        return text[i + 1:end - 1], end
+
+    if text[i] == '"':
+        # Quotes inside braces don't terminate the value
+        depth = 0
+        for match in _QUOTED_VALUE_RE.finditer(text, i + 1):
+            c = match.group()
+            if c == '{':
+                depth += 1
+            elif c == '}':
+                depth -= 1
+            elif depth == 0:
+                return text[i + 1:match.start()], match.end()
+        return text[i + 1:], len(text)
+
+    # Bare value: runs until the next ',' or the entry's closing '}'
+    match = _BARE_VALUE_END_RE.search(text, i)
+    j = match.start() if match else len(text)
+    return text[i:j], j
+
+
+def _strip_braces(value):
+    """
+    Remove protective braces ({MDMA} -> MDMA) from a display value.
+    Groups that are arguments of a LaTeX command (\\textit{...}) are kept.
+    """
+    if '{' not in value:
+        return value
+
+    parts = []
+    last = 0
+    stack = []
+    for match in _BRACE_RE.finditer(value):
+        if match.group() == '{':
+            keep = _LATEX_CMD_END_RE.search(value, 0, match.start()) is not None
+            stack.append(keep)
+        else:
+            keep = stack.pop() if stack else True
+        if not keep:
+            parts.append(value[last:match.start()])
+            last = match.end()
+    parts.append(value[last:])
+    return ''.join(parts)
 
-def parse_bibtex_file(bib_path):
+
+def iter_entries(text):
+    """
+    Scan BibTeX text in a single pass.
+    Yields (entry_type, cite_key, [(field, value), ...]) tuples.
+    @comment, @preamble and @string blocks are skipped.
+    """
+    n = len(text)
+    i = text.find('@')
+    while i != -1:
+        # Entry type runs up to the opening brace
+        brace = text.find('{', i)
+        if brace == -1:
+            return
+        entry_type = text[i + 1:brace].strip().lower()
+
+        if entry_type in ('comment', 'preamble', 'string'):
+            i = text.find('@', _skip_braced(text, brace))
+            continue
+
+        # Cite key runs up to the first comma (or the closing brace of a
+        # field-less entry)
+        key_end = _KEY_END_RE.search(text, brace)
+        if key_end is None:
+            return
+        cite_key = text[brace + 1:key_end.start()].strip()
+
+        fields = []
+        i = key_end.end()
+        while key_end.group() == ',' and i < n:
+            # Skip whitespace and separating commas
+            i = _FIELD_SEP_RE.match(text, i).end()
+            if i >= n or text[i] == '}':
+                i += 1
+                break
+
+            eq = text.find('=', i)
+            if eq == -1:
+                i = n
+                break
+            field_name = text[i:eq].strip().lower()
+
+            i = _OPT_WS_RE.match(text, eq + 1).end()
+            if i >= n:
+                break
+            value, i = _read_value(text, i)
+            fields.append((field_name, value))
+
+        yield entry_type, cite_key, fields
+        i = text.find('@', i)
+
+
+def index_bibtex(text):
+    """
+    Locate entries without parsing their fields.
+    Uses the same brace-aware scan as iter_entries, so entry boundaries agree.
+    Returns a dict mapping cite keys to (start, end) offsets in text.
+    """
+    index = {}
+    i = text.find('@')
+    while i != -1:
+        brace = text.find('{', i)
+        if brace == -1:
+            break
+        entry_type = text[i + 1:brace].strip().lower()
+        end = _skip_braced(text, brace)
+
+        if entry_type not in ('comment', 'preamble', 'string'):
+            key_end = _KEY_END_RE.search(text, brace)
+            if key_end is None:
+                break
+            index[text[brace + 1:key_end.start()].strip()] = (i, end)
+
+        i = text.find('@', end)
+    return index
+
+
+def parse_bibtex_file(bib_path, cite_keys=None):
     """
     Parse references.bib to extract all fields for each entry.
+    If cite_keys is given, only those entries are parsed.
     Returns a dict mapping cite keys to entry dictionaries.
     """
     bib_content = bib_path.read_text(encoding='utf-8')
     entries = {}
 
-    # Match BibTeX entries: @Type{key, field=value, ...}
-    entry_pattern = re.compile(
-        r'@(\w+)\{([^,]+),\s*(.*?)\n\}',
-        re.DOTALL
-    )
+    if cite_keys is None:
+        spans = [(0, len(bib_content))]
+    else:
+        index = index_bibtex(bib_content)
+        spans = [index[k] for k in cite_keys if k in index]
+
+    for start, end in spans:
+        for entry_type, cite_key, field_list in iter_entries(bib_content[start:end]):
+            fields = {'ENTRYTYPE': entry_type}
 
-    for match in entry_pattern.finditer(bib_content):
-        entry_type = match.group(1).lower()
-        cite_key = match.group(2).strip()
-        fields_text = match.group(3)
+            for field_name, field_value in field_list:
+                # Clean up whitespace
+                fields[field_name] = _WS_RE.sub(' ', field_value.strip())
 
-        # Parse fields
-        fields = {'ENTRYTYPE': entry_type}
+            # Parse names once here; inline cites and CS1 templates both reuse them.
+            # CS1 output is limited to 10 names, so truncate up front
+            fields['_authors'] = parse_authors(fields.get('author'))[:10]
+            fields['_editors'] = parse_authors(fields.get('editor'))[:10]
 
-        # Match field = {value} or field = "value"
-        field_pattern = re.compile(r'(\w+)\s*=\s*[{"]([^}"]*)[}"]', re.DOTALL)
-        for field_match in field_pattern.finditer(fields_text):
-            field_name = field_match.group(1).lower()
-            field_value = field_match.group(2).strip()
-            # Clean up whitespace
-            field_value = re.sub(r'\s+', ' ', field_value)
-            fields[field_name] = field_value
+            # Names are parsed, so protective braces can go from every value
+            for field_name, field_value in fields.items():
+                if field_name[0] != '_':
+                    fields[field_name] = _strip_braces(field_value)
 
-        entries[cite_key] = fields
+            entries[cite_key] = fields
 
     return entries
 
@@ -53,8 +218,12 @@ def format_author_name(author_str):
     """
     author_str = author_str.strip()
 
-    # Remove any {...} wrappers (e.g., {Author Redacted})
-    author_str = re.sub(r'^\{(.+)\}$', r'\1', author_str)
+    # A fully braced name (e.g., {Author Redacted}) is a single corporate name
+    if len(author_str) > 2 and author_str.startswith('{') and \
+            _skip_braced(author_str, 0) == len(author_str):
+        return (_strip_braces(author_str[1:-1]), '')
+
+    author_str = _strip_braces(author_str)
 
     # Check for "Last, First" format
     if ',' in author_str:
@@ -82,10 +251,28 @@ def parse_authors(author_field):
     if not author_field:
         return []
 
-    authors = []
-    # Split on " and " (BibTeX standard)
-    author_list = re.split(r'\s+and\s+', author_field)
+    # Fast path for single authors (field whitespace is already normalized)
+    if ' and ' not in author_field:
+        author_str = author_field.strip()
+        return [format_author_name(author_str)] if author_str else []
+
+    # Split on " and " (BibTeX standard), but not inside braced names
+    # such as {The Psychedelics and Recovered Memories Project}
+    author_list = []
+    depth = 0
+    start = 0
+    for match in _NAME_SPLIT_RE.finditer(author_field):
+        token = match.group()
+        if token == '{':
+            depth += 1
+        elif token == '}':
+            depth -= 1
+        elif depth == 0:
+            author_list.append(author_field[start:match.start()])
+            start = match.end()
+    author_list.append(author_field[start:])
 
+    authors = []
     for author_str in author_list:
         if author_str.strip():
             authors.append(format_author_name(author_str))
@@ -99,6 +286,7 @@ def entry_to_cs1(entry):
     Returns a {{cite journal}}, {{cite book}}, {{cite web}}, {{cite report}}, etc. template string.
     """
     entry_type = entry.get('ENTRYTYPE', '')
+    journal = entry.get('journal') or entry.get('journaltitle')
 
     # Determine citation template type
     if entry_type == 'report':
@@ -110,7 +298,7 @@ def entry_to_cs1(entry):
     elif entry_type in ('article', 'periodical'):
         # Article with journal field -> cite journal
         # Article without journal -> cite web
-        if entry.get('journal') or entry.get('journaltitle'):
+        if journal:
             template_type = 'cite journal'
         else:
             template_type = 'cite web'
@@ -118,7 +306,7 @@ def entry_to_cs1(entry):
         template_type = 'cite book'
     else:
         # Fallback heuristic
-        if entry.get('journal') or entry.get('journaltitle'):
+        if journal:
             template_type = 'cite journal'
         else:
             template_type = 'cite web'
@@ -127,18 +315,17 @@ def entry_to_cs1(entry):
     template_parts = [f'{{{{{template_type}']
 
     # Authors
-    if 'author' in entry:
-        authors = parse_authors(entry['author'])
-        for i, (last, first) in enumerate(authors[:10], 1):  # Limit to 10
-            if last:
-                template_parts.append(f'|last{i}={last}')
-            if first:
-                template_parts.append(f'|first{i}={first}')
+    authors = entry.get('_authors', [])
+    for i, (last, first) in enumerate(authors, 1):
+        if last:
+            template_parts.append(f'|last{i}={last}')
+        if first:
+            template_parts.append(f'|first{i}={first}')
 
     # Editors (for books, references)
-    if 'editor' in entry and not entry.get('author'):
-        editors = parse_authors(entry['editor'])
-        for i, (last, first) in enumerate(editors[:10], 1):
+    if not entry.get('author'):
+        editors = entry.get('_editors', [])
+        for i, (last, first) in enumerate(editors, 1):
             if last:
                 template_parts.append(f'|editor{i}-last={last}')
             if first:
@@ -154,8 +341,8 @@ def entry_to_cs1(entry):
     if 'title' in entry:
         title = entry['title']
         # Remove LaTeX formatting
-        title = re.sub(r'\\textit\{([^}]+)\}', r'\1', title)
-        title = re.sub(r'\\emph\{([^}]+)\}', r'\1', title)
+        title = _TEXTIT_RE.sub(r'\1', title)
+        title = _EMPH_RE.sub(r'\1', title)
         template_parts.append(f'|title={title}')
 
     # Work (for reports, this is like a series or collection name)
@@ -163,7 +350,6 @@ def entry_to_cs1(entry):
         template_parts.append(f'|work={entry["series"]}')
 
     # Journal (article or journaltitle field)
-    journal = entry.get('journal') or entry.get('journaltitle')
     if journal:
         template_parts.append(f'|journal={journal}')
 
@@ -172,9 +358,10 @@ def entry_to_cs1(entry):
         template_parts.append(f'|volume={entry["volume"]}')
 
     # Issue/Number (not for reports - they use docket instead)
+    number = entry.get('number')
     if template_type != 'cite report':
-        if 'number' in entry:
-            template_parts.append(f'|issue={entry["number"]}')
+        if number is not None:
+            template_parts.append(f'|issue={number}')
         elif 'issue' in entry:
             template_parts.append(f'|issue={entry["issue"]}')
 
@@ -197,28 +384,31 @@ def entry_to_cs1(entry):
 
     # Docket (for reports - use number field if available)
     if template_type == 'cite report':
-        if 'number' in entry:
-            template_parts.append(f'|docket={entry["number"]}')
+        if number is not None:
+            template_parts.append(f'|docket={number}')
         elif 'docket' in entry:
             template_parts.append(f'|docket={entry["docket"]}')
 
     # DOI
-    if 'doi' in entry:
-        template_parts.append(f'|doi={entry["doi"]}')
+    doi = entry.get('doi')
+    if doi is not None:
+        template_parts.append(f'|doi={doi}')
 
     # URL (only if no DOI)
-    if 'url' in entry and 'doi' not in entry:
-        template_parts.append(f'|url={entry["url"]}')
+    url = entry.get('url')
+    if url is not None and doi is None:
+        template_parts.append(f'|url={url}')
 
     # Access date (for URLs)
-    if 'urldate' in entry and 'url' in entry:
+    if 'urldate' in entry and url is not None:
         template_parts.append(f'|access-date={entry["urldate"]}')
 
     # ISBN
     if 'isbn' in entry:
         template_parts.append(f'|isbn={entry["isbn"]}')
 
-    return ''.join(template_parts) + '}}'
+    template_parts.append('}}')
+    return ''.join(template_parts)
 
 
 def main():
@@ -229,29 +419,36 @@ def main():
     file_path = Path(sys.argv[1]).resolve()
     content = file_path.read_text(encoding='utf-8')
 
+    # Pandoc HTML-escapes the <<<CITE:key>>> / <<<TEXTCITE:key>>> placeholders;
+    # undo that once so the placeholder pattern can match plain delimiters.
+    # Only closers that end a placeholder are unescaped
+    content = (
+        content.replace('&lt;&lt;&lt;CITE:', '<<<CITE:')
+        .replace('&lt;&lt;&lt;TEXTCITE:', '<<<TEXTCITE:')
+    )
+    content = _ESCAPED_CLOSER_RE.sub(r'\1>>>', content)
+
     # Parse references.bib
     bib_path = file_path.parent.parent / 'references.bib'
     if not bib_path.exists():
         print(f"Error: {bib_path} not found")
         sys.exit(1)
 
-    bib_entries = parse_bibtex_file(bib_path)
-    print(f"Loaded {len(bib_entries)} BibTeX entries from {bib_path.name}")
-
-    # Generate CS1 templates for all entries
-    cs1_templates = {}
-    for cite_key, entry in bib_entries.items():
-        cs1_templates[cite_key] = entry_to_cs1(entry)
+    # Only parse the entries that are actually cited
+    cited_keys = {
+        k.strip()
+        for match in _PLACEHOLDER_RE.finditer(content)
+        for k in match.group(2).split(',')
+    }
+    bib_entries = parse_bibtex_file(bib_path, cited_keys)
+    print(f"Loaded {len(bib_entries)} cited BibTeX entries from {bib_path.name}")
 
     # Track which citations are used
     cite_used = set()
 
     def format_author_display(entry):
         """Format author names for inline citation (e.g., 'Smith')."""
-        if 'author' not in entry:
-            return None
-
-        authors = parse_authors(entry['author'])
+        authors = entry.get('_authors')
         if not authors:
             return None
 
@@ -262,85 +459,73 @@ def main():
         else:
             return f'{authors[0][0]}'
 
-    def replace_citation(match):
+    def format_ref(cite_key):
+        """Format a single <<<CITE>>> key as a <ref> tag."""
+        if cite_key not in bib_entries:
+            print(f"Warning: Citation key '{cite_key}' not found in bibliography")
+            return f'<<<CITE:{cite_key}>>>'  # Leave as-is if not found
+
+        cite_used.add(cite_key)
+        return f'<ref name="{cite_key}" />'
+
+    def format_textcite(cite_key):
+        """Format a single <<<TEXTCITE>>> key as inline author name + <ref> tag."""
+        if cite_key not in bib_entries:
+            print(f"Warning: Citation key '{cite_key}' not found in bibliography")
+            return f'<<<TEXTCITE:{cite_key}>>>'  # Leave as-is if not found
+
+        cite_used.add(cite_key)
+        entry = bib_entries[cite_key]
+        author_display = format_author_display(entry)
+        if not author_display:
+            # Fallback if no author
+            return f'<ref name="{cite_key}" />'
+
+        # Include year if available (check both 'year' and 'date' fields)
+        year = entry.get('year', '') or entry.get('date', '')
+        if year:
+            return f'{author_display} ({year})<ref name="{cite_key}" />'
+        return f'{author_display}<ref name="{cite_key}" />'
+
+    def replace_citation(cite_keys_str):
         """Replace <<<CITE:key>>> placeholders with <ref> tags."""
-        cite_keys_str = match.group(1)
+        return ''.join([format_ref(k.strip()) for k in cite_keys_str.split(',')])
 
-        # Split multiple keys
-        cite_keys = [k.strip() for k in cite_keys_str.split(',')]
-
-        # Generate ref tags
-        refs = []
-        for cite_key in cite_keys:
-            if cite_key in bib_entries:
-                cite_used.add(cite_key)
-                refs.append(f'<ref name="{cite_key}" />')
-            else:
-                print(f"Warning: Citation key '{cite_key}' not found in bibliography")
-                refs.append(f'<<<CITE:{cite_key}>>>')  # Leave as-is if not found
-
-        return ''.join(refs)
-
-    def replace_textcitation(match):
+    def replace_textcitation(cite_keys_str):
         """Replace <<<TEXTCITE:key>>> with inline author name + <ref> tag."""
-        cite_keys_str = match.group(1)
-
-        # Split multiple keys (though textcite typically uses single keys)
-        cite_keys = [k.strip() for k in cite_keys_str.split(',')]
-
-        # Generate inline citations
-        results = []
-        for cite_key in cite_keys:
-            if cite_key in bib_entries:
-                cite_used.add(cite_key)
-                entry = bib_entries[cite_key]
-                author_display = format_author_display(entry)
-
-                if author_display:
-                    # Include year if available (check both 'year' and 'date' fields)
-                    year = entry.get('year', '') or entry.get('date', '')
-                    if year:
-                        results.append(f'{author_display} ({year})<ref name="{cite_key}" />')
-                    else:
-                        results.append(f'{author_display}<ref name="{cite_key}" />')
-                else:
-                    # Fallback if no author
-                    results.append(f'<ref name="{cite_key}" />')
-            else:
-                print(f"Warning: Citation key '{cite_key}' not found in bibliography")
-                results.append(f'<<<TEXTCITE:{cite_key}>>>')  # Leave as-is if not found
-
-        return ' '.join(results)
-
-    # Replace &lt;&lt;&lt;CITE:key&gt;&gt;&gt; placeholders (HTML-escaped by pandoc)
-    # Matches: &lt;&lt;&lt;CITE:key&gt;&gt;&gt; or &lt;&lt;&lt;CITE:key1,key2&gt;&gt;&gt;
-    content = re.sub(
-        r'&lt;&lt;&lt;CITE:([^&]+)&gt;&gt;&gt;',
-        replace_citation,
-        content
-    )
+        # Multiple keys are allowed, though textcite typically uses single keys
+        return ' '.join([format_textcite(k.strip()) for k in cite_keys_str.split(',')])
 
-    # Replace &lt;&lt;&lt;TEXTCITE:key&gt;&gt;&gt; placeholders
-    content = re.sub(
-        r'&lt;&lt;&lt;TEXTCITE:([^&]+)&gt;&gt;&gt;',
-        replace_textcitation,
-        content
-    )
+    def replace_placeholder(match):
+        if match.group(1) == 'TEXTCITE':
+            return replace_textcitation(match.group(2))
+        return replace_citation(match.group(2))
 
-    # Remove any existing <references /> placeholder
-    content = re.sub(r'<references\s*/>', '', content)
-
-    # Build list-defined references section
-    if cite_used:
-        refs_section = '\n\n== References ==\n<references>\n'
-        for cite_key in sorted(cite_used):
-            refs_section += f'<ref name="{cite_key}">{cs1_templates[cite_key]}</ref>\n'
-        refs_section += '</references>\n'
+    # Replace <<<CITE:key>>> and <<<TEXTCITE:key>>> placeholders in a single pass
+    # Matches: <<<CITE:key>>> or <<<CITE:key1,key2>>>
+    content = _PLACEHOLDER_RE.sub(replace_placeholder, content)
 
-        content = content.rstrip() + refs_section
+    # Remove any existing <references /> placeholder
+    content = _REFERENCES_TAG_RE.sub('', content)
+
+    # Build list-defined references section before opening the output:
+    # the output is also the input, so nothing may fail after truncating it
+    # (CS1 templates are only generated for entries that are actually cited)
+    ref_lines = [
+        f'<ref name="{cite_key}">{entry_to_cs1(bib_entries[cite_key])}</ref>\n'
+        for cite_key in sorted(cite_used)
+    ]
+
+    # Write output, streaming the references section after the body
+    with file_path.open('w', encoding='utf-8') as f:
+        if not ref_lines:
+            f.write(content)
+        else:
+            f.write(content.rstrip())
+            f.write('\n\n== References ==\n<references>\n')
+            f.writelines(ref_lines)
+            f.write('</references>\n')
 
-    # Write output
-    file_path.write_text(content, encoding='utf-8')
     print(f"Converted {len(cite_used)} unique citations to CS1 templates")
     print(f"Output written to {file_path}")
 